@@ -281,53 +281,237 @@
 #        disconnect
 #        reconnect
 
+import argparse
+import asyncio
+import collections
+import functools
+import io
 import json
+import logging
+import logging.handlers
+import mimetypes
 import re
 import sys
 import os
-import html
+import random
+import tempfile
 import time
+import types
 from datetime import datetime
+import aiohttp
 import discord
 from discord.ext import commands
+try:
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = logging.getLogger("slack2discord")
+
+# Parsed once as numbers, as comparing the version strings breaks on e.g. "10.0.0"
+DISCORD_VERSION = tuple(int(part) for part in re.match(r"(\d+)\.(\d+)", discord.__version__).groups())
+DISCORD_V2 = DISCORD_VERSION >= (2, 0) # Threads and multiple embeds per message
 
-MAX_EMBEDS = 1
-if discord.__version__[0] >= "2":
-    MAX_EMBEDS = 10
+MAX_EMBEDS = 10 if DISCORD_V2 else 1
 
 MAX_CHARACTERS = 2000
+# Send consecutive plain messages (no attachments, not in a thread) by the same user as one message,
+#  up to MAX_CHARACTERS, which takes far fewer sends for chatty channels. Each keeps its own header line.
+COALESCE_MESSAGES = False
+DISABLE_MENTIONS = discord.AllowedMentions.none() # Imported messages must not ping anyone; never modified, so shared by all sends
 MAX_EMBED_CHARACTERS = 4096
 MAX_TOTAL_EMBEDS_CHARACTERS = 6000 # https://discord.com/developers/docs/resources/channel#embed-object-embed-limits
 
 THROTTLE = True
-THROTTLE_TIME_SECONDS = 0.1
+THROTTLE_TIME_SECONDS = 0.1 # Average time between sends
+THROTTLE_BURST = 5 # Sends allowed back-to-back before throttling kicks in
+SEND_RETRIES = 5 # Attempts at a send that Discord keeps rejecting with 429 Too Many Requests
+SEND_RETRY_JITTER_SECONDS = 0.1 # Random extra wait, so concurrently imported channels don't all retry at once
+
+CHANNEL_CONCURRENCY = 8 # Channels imported at the same time by import_all; each channel's messages stay in order
+
+# Send through a webhook per channel (requires the Manage Webhooks permission, and discord.py >= 2.0).
+#  Webhooks are rate limited separately from the bot and from each other, so each channel's webhook gets its own
+#  send bucket instead of sharing send_bucket, and concurrently imported channels don't hold each other up.
+USE_WEBHOOKS = False
+WEBHOOK_NAME = "slack2discord"
+WEBHOOK_THROTTLE_TIME_SECONDS = 0.4 # Average time between sends through one webhook; Discord allows about 5 per 2 seconds
+
+
+LOG_BUFFER_RECORDS = 100 # Log records written to the console together; warnings and errors are written immediately
+
+DOWNLOAD_CONNECTIONS = 8 # Concurrent attachment downloads from Slack's file host, shared by all channels; more risks Slack's rate limiting
+DOWNLOAD_TIMEOUT_SECONDS = 30 # Time allowed to connect, and then between chunks; slow downloads that keep progressing never time out
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+DOWNLOAD_SPOOL_BYTES = 1024 * 1024 # Downloads larger than this are buffered on disk until uploaded
+
+JSON_BUFFER_SIZE = 1 << 20 # Bytes ijson reads from users.json and channels.json at a time
+
+# ijson reports malformed files with its own exception type
+JSON_ERRORS = (json.JSONDecodeError, ijson.JSONError) if ijson else (json.JSONDecodeError,)
+
+# Message subtypes that are not imported
+SKIP_SUBTYPES = frozenset({"channel_join", "bot_message"})
+
+# Slack only escapes these three entities in message text (https://api.slack.com/reference/surfaces/formatting#escaping),
+#  so they and @everyone are replaced in a single pass
+SLACK_ESCAPES = {"&amp;": "&", "&lt;": "<", "&gt;": ">", "<!everyone>": "@everyone"}
+SLACK_ESCAPE_RE = re.compile(r"&(?:amp|lt|gt);|<!everyone>")
+
+# Slack encodes mentions as <@U0123ABCD>, channel references as <#C0123ABCD|name>
+#  and links as <https://url> or <https://url|label>, all matched in a single pass
+SLACK_TOKEN_RE = re.compile(r"<(?:@(?P<uid>[UW][A-Z0-9]+)"
+                            r"|#(?P<cid>[CG][A-Z0-9]+)\|(?P<cname>[^>]+)"
+                            r"|(?P<url>https?:[^|>]+)(?:\|(?P<label>[^>]+))?)>")
+
+# Lookups by name scan the whole guild, so results are cached per (guild id, name).
+# Filled on_ready, and cleared whenever members join or channels are created.
+member_cache = {}
+channel_cache = {}
+# Replacements of Slack tokens (mentions, channel references) by (guild id, token), as the same few
+#  tokens repeat across a whole export. Also cleared when an import starts, as the mapping files may have changed.
+mention_cache = {}
+
+# Parsed root files by path, as (mtime, result), so re-imports skip unchanged files
+root_file_cache = {}
+
+# Formatted timestamps by whole second, as messages are often posted within the same second
+timestamp_cache = {}
+TIMESTAMP_CACHE_SIZE = 4096 # Entries kept before the cache is emptied
+
+
+def setup_logging(verbose=False, log_file=None):
+    """
+    Logs to the console in the "[LEVEL] message" format, buffering the per-message DEBUG records so they are written in batches
+    :param verbose: Also log the DEBUG records, e.g. every user and channel loaded from the export
+    :param log_file: Optional path of a file that also gets every record, with its time
+    """
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    # INFO and above are written right away; there are only a few per channel, and the import would look stuck otherwise
+    log.addHandler(logging.handlers.MemoryHandler(LOG_BUFFER_RECORDS, flushLevel=logging.INFO, target=console))
+    if log_file:
+        file = logging.FileHandler(log_file, encoding="utf-8")
+        file.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+        log.addHandler(logging.handlers.MemoryHandler(LOG_BUFFER_RECORDS, flushLevel=logging.WARNING, target=file))
+    log.setLevel(logging.DEBUG if verbose else logging.INFO)
+    log.propagate = False # discord.py logs through its own handler
+
+
+def query_user(prompt):
+    """
+    Asks the user for input, after writing out any buffered log records so they appear before the prompt
+    :param prompt: Question to ask
+    :return: The user's answer
+    """
+    for handler in log.handlers:
+        handler.flush()
+    return input(prompt)
 
 
 def check_optional_dependencies():
-    print(f"[INFO] Checking (optional) dependency versions:")
-    if discord.__version__[0] < "2":
+    log.info("Checking (optional) dependency versions:")
+    if not DISCORD_V2:
         # Pre discord.py v2.0 the bot can only give messages 1 embed,
         #  so has to be split into multiple messages.
         # Creating threads was added in discord.py v2.0
         # discord.py v2.0 also increased the package's requirements,
         #  requiring a higher python version.
         # It is thus treated as optional.
-        print(f"[WARNING] discord.py version < 2.0, currently using version: {discord.__version__}")
-        print(f"          Some features are unsupported with current version:")
-        print(f"          * Unable to create Threads")
-        print(f"            - Messages will be sent directly to the owner's TextChannel instead.")
-        print(f"          * Messages are unable to contain more than 1 Embed each")
-        print(f"            - Multiple attachments they will be split into multiple messages,")
-        print(f"               linking to their 'parent' message.")
-        print(f"          Upgrade discord.py to >= 2.0 to enable those features.")
+        log.warning(f"discord.py version < 2.0, currently using version: {discord.__version__}\n"
+                    "          Some features are unsupported with current version:\n"
+                    "          * Unable to create Threads\n"
+                    "            - Messages will be sent directly to the owner's TextChannel instead.\n"
+                    "          * Messages are unable to contain more than 1 Embed each\n"
+                    "            - Multiple attachments they will be split into multiple messages,\n"
+                    "               linking to their 'parent' message.\n"
+                    "          Upgrade discord.py to >= 2.0 to enable those features.")
         
-        if sys.version_info[1] < 8:
-            print(f"[INFO] Current python version does not satisfy discord.py v2.0 dependency. Current: {'.'.join(map(str, sys.version_info[:3]))}")
-            print(f"       You will be unable to upgrade discord.py to v2.0,")
-            print(f"        unless you first upgrade python to >= 3.8")
+        if sys.version_info < (3, 8):
+            log.info(f"Current python version does not satisfy discord.py v2.0 dependency. Current: {'.'.join(map(str, sys.version_info[:3]))}\n"
+                     "       You will be unable to upgrade discord.py to v2.0,\n"
+                     "        unless you first upgrade python to >= 3.8")
     else:
-        print(f"       All features enabled! - No dependencies unsatisfied")
-    print(f"")
+        log.info("All features enabled! - No dependencies unsatisfied")
+    if ijson is None:
+        log.info("ijson not installed - users.json and channels.json will be loaded whole instead of streamed.\n"
+                 "       Install it with ``pip install ijson`` to reduce memory use on large workspaces.")
+    if orjson is None:
+        log.info("orjson not installed - .json files will be parsed with the slower standard library json module.\n"
+                 "       Install it with ``pip install orjson`` to speed up loading large exports.")
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing bursts of up to `capacity` calls, refilled continuously at `rate` calls per second.
+    Unlike sleeping after every call, it only waits once the budget is actually used up.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0 # Monotonic time until which the server asked us to stop, see penalize
+        self.lock = None # Created on first use, so it belongs to the bot's event loop
+
+    async def acquire(self, n=1):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            # Re-checked after every sleep, as penalize may be called by other senders meanwhile
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+    def penalize(self, retry_after):
+        """
+        Blocks the bucket so that no call goes through until a rate limit reported by the server has passed,
+        and empties it so calls don't burst right after
+        :param retry_after: Seconds until the server accepts calls again
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        self.tokens = 0
+        self.updated = self.blocked_until
+
+
+send_bucket = TokenBucket(1 / THROTTLE_TIME_SECONDS, THROTTLE_BURST)
+
+
+async def throttled_send(ctx, *args, **kwargs):
+    """
+    Sends through ctx once the send bucket allows it, retrying with exponential backoff
+    if Discord still answers 429 Too Many Requests after discord.py's own retries
+    """
+    # Webhooks have their own rate limits, and so their own buckets
+    bucket = ctx.bucket if isinstance(ctx, WebhookDestination) else send_bucket
+    for attempt in range(SEND_RETRIES):
+        if THROTTLE:
+            await bucket.acquire()
+        try:
+            return await ctx.send(*args, **kwargs)
+        except discord.HTTPException as e:
+            # discord.py closes attachments after a send, so those cannot be sent again
+            if e.status != 429 or attempt == SEND_RETRIES - 1 or kwargs.get("file") or kwargs.get("files"):
+                raise
+            retry_after = float(e.response.headers.get("Retry-After", THROTTLE_TIME_SECONDS)) * 2 ** attempt
+            retry_after += random.uniform(0, SEND_RETRY_JITTER_SECONDS)
+            log.warning("Rate limited by Discord, retrying in %.1f seconds", retry_after)
+            if THROTTLE:
+                bucket.penalize(retry_after) # Holds back the other sends sharing the bucket too
+            else:
+                await asyncio.sleep(retry_after)
 
 
 def get_basename(file_path):
@@ -340,13 +524,43 @@ def get_basename(file_path):
 def get_filename(file_path):
     return get_basename(os.path.splitext(file_path)[0])
 
+def scan_directory(path):
+    """
+    Lists a directory in a single pass, using the entry types os.scandir already read instead of a stat() per entry
+    :param path: String path to directory
+    :return: Tuple of (set of file names, list of (name, path) of subdirectories), both empty if path is not a readable directory
+    """
+    file_names = set()
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append((entry.name, entry.path))
+                elif entry.is_file():
+                    file_names.add(entry.name)
+    except OSError:
+        pass
+    return file_names, subdirs
+
+
+def list_json_logs(path):
+    """
+    Lists a channel directory's .json logs in date order, as they are named by date (e.g. 2022-07-29.json)
+    :param path: String path to the channel directory
+    :return: Tuple of paths to the .json logs
+    """
+    with os.scandir(path) as entries:
+        logs = sorted((entry.name, entry.path) for entry in entries if entry.name.endswith(".json") and entry.is_file())
+    return tuple(log_path for _, log_path in logs)
+
 # async
 def parse_slack_directory(file_path, force_all=False):
     """
     Parses the path to find important root-files and relevant .json logs, and stores them in a dict of the form:\n
     {
         "root_files": {"file": path},\n
-        "history": {"channel": [path_json_logs]}
+        "history": {"channel": (path_json_logs, in date order)}
     }
     :param file_path: String path to directory or file
     :return: The resulting dict.
@@ -366,92 +580,146 @@ def parse_slack_directory(file_path, force_all=False):
     root_files = dict(slack_root_files, **user_root_files)
 
     # Locate root
-    print(f"[INFO] Attempting to locate slack-root directory from path: {file_path}")
+    log.info(f"Attempting to locate slack-root directory from path: {file_path}")
     root = file_path
     if os.path.isfile(file_path):
-        print("[WARNING] Path points at a file and not a directory")
-        print("[INFO] Assumes parent-directory is either root or a channel-subdir")
-        print("       | slack-root/  <- directory?")
-        print("       |__  *.json")
-        print("          | channel/  <- directory?")
-        print("          |    *.json")
+        log.warning("Path points at a file and not a directory")
+        log.info("Assumes parent-directory is either root or a channel-subdir\n"
+                 "       | slack-root/  <- directory?\n"
+                 "       |__  *.json\n"
+                 "          | channel/  <- directory?\n"
+                 "          |    *.json")
         root = os.path.dirname(file_path)
-        
-    if any([os.path.exists(os.path.join(root, f)) for f in slack_root_files]):
-        print(f"[INFO] Success! slack-root found: {root}")
+
+    root_names, root_subdirs = scan_directory(root)
+    if slack_root_files.keys() & root_names:
+        log.info(f"Success! slack-root found: {root}")
     else:
-        print(f"[WARNING] Directory is not root of a slack-log directory: {root}")
-        print("[INFO] Assumes directory is a channel-subdir, and parent-directory is the root.")
-        print("       | slack-root/  <- root?")
-        print("       |__  *.json")
-        print("          | channel/  <- directory")
-        print("          |    *.json")
+        log.warning(f"Directory is not root of a slack-log directory: {root}")
+        log.info("Assumes directory is a channel-subdir, and parent-directory is the root.\n"
+                 "       | slack-root/  <- root?\n"
+                 "       |__  *.json\n"
+                 "          | channel/  <- directory\n"
+                 "          |    *.json")
         root = os.path.dirname(root)
-        if any([os.path.exists(os.path.join(root, f)) for f in slack_root_files]):
-            print(f"[INFO] Success! slack-root found: {root}")
+        root_names, root_subdirs = scan_directory(root)
+        if slack_root_files.keys() & root_names:
+            log.info(f"Success! slack-root found: {root}")
         else:
-            print("[WARNING] Parent-directory is not root of a slack-log directory; Unable to locate root")
-            query = input("\nDo you want to ignore and continue with input path forcefully treated as 'root'? (Y/N): ")
+            log.warning("Parent-directory is not root of a slack-log directory; Unable to locate root")
+            query = query_user("\nDo you want to ignore and continue with input path forcefully treated as 'root'? (Y/N): ")
             if query.lower() in ["y", "yes"]:
-                print(f"[INFO] Reverts to treating input path as root: {file_path}")
+                log.info(f"Reverts to treating input path as root: {file_path}")
                 root = file_path
+                root_names, root_subdirs = scan_directory(root)
             else:
-                print(f"[ERROR] User aborted - no root")
+                log.error("User aborted - no root")
                 return None
 
     # Assert existence of root-files, querying user to ignore errors
     for ft, ft_files in {"slack": slack_root_files, "user-created": user_root_files}.items():
-        print("[INFO] Checking for {ft} files")
+        log.info(f"Checking for {ft} files")
         if ft == "user-created":
-            print("       Note: User is expected to manually create and fill these files if their functionality is desired.")
+            log.info("Note: User is expected to manually create and fill these files if their functionality is desired.")
         for f, descr in ft_files.items():
             f_path = os.path.join(root, f)
-            if os.path.exists(f_path):
-                print(f"[INFO] Successfully located {ft} file: {f}")
-                slack_dir["root_files"][get_filename(f)] = f_path
+            if f in root_names:
+                log.info(f"Successfully located {ft} file: {f}")
+                slack_dir["root_files"][f.rsplit(".", 1)[0]] = f_path
             else:
-                print(f"[ERROR] Unable to locate {ft} file: {f}")
-                print(f"        Description: {descr}")
-                query = input("\nDo you want to ignore and continue? (Y/N): ")
+                log.error(f"Unable to locate {ft} file: {f}\n"
+                          f"        Description: {descr}")
+                query = query_user("\nDo you want to ignore and continue? (Y/N): ")
                 if query.lower() in ["y", "yes"]:
-                    print(f"[OK] User ignored missing {ft} file.")
+                    log.info(f"User ignored missing {ft} file.")
                 else:
-                    print(f"[ERROR] User aborted at missing {ft} file: {f}")
+                    log.error(f"User aborted at missing {ft} file: {f}")
                     return None
     
     # locate .json logs
-    print(f"[INFO] Attempting to locate relevant .json logs")
+    log.info("Attempting to locate relevant .json logs")
     if force_all is True:
-        subdirs = [d for d in [os.path.join(root, n) for n in os.listdir(root)] if os.path.isdir(d)]
-        for d in subdirs:
-            slack_dir["history"][get_basename(d)] = [os.path.join(d, f) for f in os.listdir(d) if f.endswith(".json")]
+        for name, d in root_subdirs:
+            slack_dir["history"][name] = list_json_logs(d)
     else:
         if os.path.isfile(file_path):
-            print(f"[WARNING] Path does not point at a directory.")
-            print(f"[INFO] Assumes path points at the exact .json log file user wants to export.")
+            log.warning("Path does not point at a directory.")
+            log.info("Assumes path points at the exact .json log file user wants to export.")
             if file_path.endswith(".json"):
-                slack_dir["history"][get_basename(os.path.dirname(file_path))] = file_path
+                slack_dir["history"][get_basename(os.path.dirname(file_path))] = (file_path,)
             else:
-                print(f"[ERROR] Path does not point at a .json file - skipping path.")
+                log.error("Path does not point at a .json file - skipping path.")
                 return None
         else:
-            subdirs = [file_path] + [d for d in [os.path.join(file_path, n) for n in os.listdir(file_path)] if os.path.isdir(d)]
-            for d in subdirs:
-                slack_dir["history"][get_basename(d)] = [os.path.join(d, f) for f in os.listdir(d) if f.endswith(".json")]
+            # scandir already knows the subdirectories' names; only the input path needs get_basename
+            subdirs = [(get_basename(file_path), file_path)] + scan_directory(file_path)[1]
+            for name, d in subdirs:
+                slack_dir["history"][name] = list_json_logs(d)
     
     slack_dir["root"] = root
 
     if not slack_dir["history"]:
-        print(f"[ERROR] No history .json logs found at: {file_path}")
+        log.error(f"No history .json logs found at: {file_path}")
         return None
     else:
-        print(f"[INFO] Success! {len(slack_dir['history'])} .json logs loaded")
-        if not all([get_filename(f) in slack_dir["root_files"] for f in root_files]):
-            print(f"[WARNING] Missing important .json files: {({f: ('exists' if get_filename(f) in slack_dir['root_files'] else 'missing') for f in root_files})}")
+        log.info(f"Success! {len(slack_dir['history'])} .json logs loaded")
+        if not all(f.rsplit(".", 1)[0] in slack_dir["root_files"] for f in root_files):
+            log.warning(f"Missing important .json files: {({f: ('exists' if f.rsplit('.', 1)[0] in slack_dir['root_files'] else 'missing') for f in root_files})}")
 
     return slack_dir
 
 
+def load_json(f):
+    """
+    Parses a whole JSON file, with orjson if it is installed
+    :param f: File opened in binary mode
+    :return: The parsed JSON
+    """
+    if orjson:
+        return orjson.loads(f.read())
+    return json.load(f)
+
+
+def dump_json(obj, f):
+    """
+    Writes obj as indented JSON, with orjson if it is installed
+    :param obj: JSON-serializable object
+    :param f: File opened in binary mode
+    """
+    if orjson:
+        f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        f.write(json.dumps(obj, indent=1).encode("utf-8"))
+
+
+def iter_json_array(f):
+    """
+    Iterates over the items of a file containing a top-level JSON array,
+    streaming them one at a time if ijson is installed.
+    :param f: File opened in binary mode
+    :return: Iterable of the array's items
+    """
+    if ijson:
+        return ijson.items(f, "item", use_float=True, buf_size=JSON_BUFFER_SIZE)
+    return load_json(f)
+
+
+def get_cached_root_file(file_path):
+    """
+    Looks up a previously parsed root file
+    :param file_path: Path of the root file
+    :return: The cached result, or None if not cached or the file changed since
+    """
+    cached = root_file_cache.get(file_path)
+    if cached and cached[0] == os.path.getmtime(file_path):
+        return cached[1]
+    return None
+
+
+def set_cached_root_file(file_path, result):
+    root_file_cache[file_path] = (os.path.getmtime(file_path), result)
+
+
 def get_display_names(slack_dir):
     """
     Generates a dictionary of user_id => display_name pairs
@@ -460,25 +728,33 @@ def get_display_names(slack_dir):
     """
     users = {}
 
-    print(f"[INFO] Attempting to locate users.json")
+    log.info("Attempting to locate users.json")
 
     file_path = slack_dir["root_files"].get("users", None)
     if (not file_path) or (not os.path.isfile(file_path)):
-        print(f"[ERROR] Unable to locate users.json: {file_path}")
+        log.error(f"Unable to locate users.json: {file_path}")
         return None
+
+    cached = get_cached_root_file(file_path)
+    if cached is not None:
+        log.info(f"users.json unchanged since last import - reusing its {len(cached)} users")
+        return cached
+
     try:
-        with open(file_path, encoding="utf-8") as f:
-            users_json = json.load(f)
-            for user in users_json:
+        with open(file_path, "rb") as f:
+            for user in iter_json_array(f):
                 users[user['id']] = (
                     user['profile']['display_name'] if user['profile']['display_name'] else user['profile'][
                         'real_name'])
-                print(f"\tUser ID: {user['id']} -> Display Name: {users[user['id']]}")
+        # Only formatted with --verbose, as log.debug would otherwise discard the listing after building it
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("\n".join(f"\tUser ID: {uid} -> Display Name: {name}" for uid, name in users.items()))
+        set_cached_root_file(file_path, users)
     except OSError as e:
-        print(f"[ERROR] Unable to load display names: {e}")
+        log.error(f"Unable to load display names: {e}")
         return None
-    except json.JSONDecodeError as e:
-        print(f"[ERROR] Unable to load users.json.\n  JSONDecodeError: {e}")
+    except JSON_ERRORS as e:
+        log.error(f"Unable to load users.json.\n  {type(e).__name__}: {e}")
     return users
 
 
@@ -493,55 +769,73 @@ def get_slack2discord_user_mapping(slack_dir, users):
     """
     slack2discord_uids = {}
 
-    print(f"[INFO] Attempting to locate slack2discord_users.json")
+    # Inverted index of (slack name) => [slack user IDs], for entries without an ID
+    name_to_ids = {}
+    for uid, name in (users or {}).items():
+        name_to_ids.setdefault(name, []).append(uid)
+
+    log.info("Attempting to locate slack2discord_users.json")
     
     file_path = slack_dir["root_files"].get("slack2discord_users", None)
     if (not file_path) or (not os.path.isfile(file_path)):
-        print(f"[ERROR] Unable to locate slack2discord_users.json: {file_path}")
+        log.error(f"Unable to locate slack2discord_users.json: {file_path}")
         return None
 
+    # Name-only entries are resolved through users, so the cached mapping is only valid for the same users
+    cached = get_cached_root_file(file_path)
+    if cached is not None and cached[0] is users:
+        log.info(f"slack2discord_users.json unchanged since last import - reusing its {len(cached[1])} mappings")
+        return cached[1]
+
+    dirty = False # Should we rewrite the json?
     try:
-        with open(file_path, encoding="utf-8") as f:
-            slack2discord_users_json = json.load(f)
-            dirty = False # Should we rewrite the json?
-            for user in slack2discord_users_json:
-                try:
-                    slack_id = user["slack"]["id"]
-                except KeyError:
-                    slack_name = user["slack"]["name"]
-                    possible_slack_ids = [id
-                        for (id,name) in users.items()
-                        if name == slack_name]
-                    if len(possible_slack_ids) == 0:
-                        print(f"[WARNING] There is no Slack user named \"{slack_name}\"")
-                        continue
-                    elif len(possible_slack_ids) == 1:
-                        slack_id = possible_slack_ids[0]
-                    else:
-                        print(f"[WARNING] There is more than one Slack user named \"{slack_name}\"")
-                        print(f"[FIX] Querying user which is the intended mapping")
-                        print(f"[ERROR] ... but that's not implemented") # TODO
-                        continue
-                    user["slack"]["id"] = slack_id
-                    dirty = True
-                discord_name = user["discord"]["name"]
-                if user["discord"]["id"]:
-                    discord_name = discord_name + f'#{user["discord"]["id"]}'
-                slack2discord_uids[slack_id] = discord_name
-                print(f"\tslack2discord user mapping: {slack_id} -> {discord_name}")
+        with open(file_path, "rb") as f:
+            slack2discord_users_json = load_json(f)
+        # Fill in the Slack IDs of entries containing only names, so the mapping is built from IDs alone
+        for user in slack2discord_users_json:
+            if "id" in user["slack"]:
+                continue
+            slack_name = user["slack"]["name"]
+            possible_slack_ids = name_to_ids.get(slack_name, [])
+            if len(possible_slack_ids) == 0:
+                log.warning(f"There is no Slack user named \"{slack_name}\"")
+            elif len(possible_slack_ids) == 1:
+                user["slack"]["id"] = possible_slack_ids[0]
+                dirty = True
+            else:
+                log.warning(f"There is more than one Slack user named \"{slack_name}\"")
+                log.info("Querying user which is the intended mapping")
+                log.error("... but that's not implemented") # TODO
+        slack2discord_uids = {
+            user["slack"]["id"]: (f'{user["discord"]["name"]}#{user["discord"]["id"]}' if user["discord"].get("id")
+                                  else user["discord"]["name"])
+            for user in slack2discord_users_json
+            if "id" in user["slack"]}
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("\n".join(f"\tslack2discord user mapping: {slack_id} -> {discord_name}"
+                                for slack_id, discord_name in slack2discord_uids.items()))
     except OSError as e:
-        print(f"[ERROR] Unable to load slack2discord user mapping: {e}")
+        log.error(f"Unable to load slack2discord user mapping: {e}")
         return None
     except json.JSONDecodeError as e:
-        print(f"[ERROR] Unable to load slack2discord_users.json.\n  JSONDecodeError: {e}")
+        log.error(f"Unable to load slack2discord_users.json.\n  JSONDecodeError: {e}")
     
     if dirty:
+        # Written next to the original and then swapped in, so a crash never leaves a half-written mapping
+        tmp_path = file_path + ".tmp"
         try:
-            with open(file_path, mode="w", encoding="utf-8") as f:
-                json.dump(slack2discord_users_json, f, indent=1)
+            with open(tmp_path, mode="wb") as f:
+                dump_json(slack2discord_users_json, f)
+            os.replace(tmp_path, file_path)
         except OSError as e:
-            print(f"[ERROR] Unable to save modified slack2discord user mapping: {e}")
-
+            log.error(f"Unable to save modified slack2discord user mapping: {e}")
+            # Don't leave the partial copy behind
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    set_cached_root_file(file_path, (users, slack2discord_uids))
     return slack2discord_uids
 
 
@@ -553,101 +847,182 @@ def get_channel_names(slack_dir):
     """
     channels = {}
 
-    print(f"[INFO] Attempting to locate channels.json")
+    log.info("Attempting to locate channels.json")
 
     file_path = slack_dir["root_files"].get("channels", None)
     if (not file_path) or (not os.path.isfile(file_path)):
-        print(f"[ERROR] Unable to locate channels.json: {file_path}")
+        log.error(f"Unable to locate channels.json: {file_path}")
         return None
 
+    cached = get_cached_root_file(file_path)
+    if cached is not None:
+        log.info(f"channels.json unchanged since last import - reusing its {len(cached)} channels")
+        return cached
+
     try:
-        with open(file_path, encoding="utf-8") as f:
-            channels_json = json.load(f)
-            for channel in channels_json:
+        with open(file_path, "rb") as f:
+            for channel in iter_json_array(f):
                 channels[channel['id']] = channel['name']
-                print(f"\tChannel ID: {channel['id']} -> Channel Name: {channels[channel['id']]}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("\n".join(f"\tChannel ID: {cid} -> Channel Name: {name}" for cid, name in channels.items()))
+        set_cached_root_file(file_path, channels)
     except OSError as e:
-        print(f"[ERROR] Unable to load channel names: {e}")
+        log.error(f"Unable to load channel names: {e}")
         return None
-    except json.JSONDecodeError as e:
-        print(f"[ERROR] Unable to load channels.json.\n  JSONDecodeError: {e}")
+    except JSON_ERRORS as e:
+        log.error(f"Unable to load channels.json.\n  {type(e).__name__}: {e}")
     return channels
 
-def process_link(match_obj):
-    return f"[{match_obj.group(1)}]({match_obj.group(2)})"
+def prime_guild_caches(guild):
+    """
+    Fills the member and channel caches from the guild's current members and channels
+    :param guild: Guild to cache
+    """
+    # Same lookup as the installed discord.py's Guild.get_member_named: an exact "name#discriminator" first,
+    #  otherwise the first member whose nickname, global name (discord.py >= 2.3) or name matches
+    for member in guild.members:
+        member_cache.setdefault((guild.id, f"{member.name}#{member.discriminator}"), member)
+    for member in guild.members:
+        for name in (member.nick, getattr(member, "global_name", None), member.name):
+            if name:
+                member_cache.setdefault((guild.id, name), member)
+    for channel in guild.channels:
+        # setdefault keeps the first match, same as discord.utils.get
+        channel_cache.setdefault((guild.id, channel.name), channel)
+
+
+def clear_guild_caches(guild):
+    for cache in (member_cache, channel_cache, mention_cache):
+        for key in [k for k in cache if k[0] == guild.id]:
+            del cache[key]
+
+
+def get_member_named(guild, name):
+    key = (guild.id, name)
+    if key not in member_cache:
+        member_cache[key] = guild.get_member_named(name)
+    return member_cache[key]
+
+
+def get_channel_named(guild, name):
+    key = (guild.id, name)
+    if key not in channel_cache:
+        channel_cache[key] = discord.utils.get(guild.channels, name=name)
+    return channel_cache[key]
+
+
+def resolve_user_mappings(guild, slack2discord_uids):
+    """
+    Looks up every mapped discord user once before the import, so per-message lookups are cache hits,
+    and reports the mapped users missing from the guild up front
+    :param guild: Guild the import is sent to
+    :param slack2discord_uids: Dictionary of (slack user ID) => (discord username), or None
+    """
+    missing = [discord_name
+        for discord_name in (slack2discord_uids or {}).values()
+        if not get_member_named(guild, discord_name)]
+    if missing:
+        log.warning(f"{len(missing)} mapped users not found on discord: {', '.join(missing)}\n"
+                    "          Their messages and @mentions will show their names instead")
+
 
 # async
 def fill_references(ctx, message, users, slack2discord_uids, channels, messages):
     """
-    Fills in @mentions and #channels with their known display names
+    Fills in @mentions and #channels with their known display names, and converts links to markdown
     :param message: Raw message to be filled with usernames and channel names instead of IDs
     :param users: Dictionary of user_id => display_name pairs
     :param channels: Dictionary of channel_id => channel_name pairs
-    :return: Filled message string
+    :return: (filled message string, whether any links were converted to markdown)
     """
+    # Every Slack token starts with "<", and most messages contain none
+    if "<" not in message:
+        return message, False
+
+    def resolve_user(match):
+        uid = match.group("uid")
+        slack_name = users.get(uid) if users else None
+        if not slack_name:
+            return match.group(0)
+        new_str = f"@{slack_name}"
+        if slack2discord_uids and uid in slack2discord_uids:
+            discord_name = slack2discord_uids[uid]
+            discord_user = get_member_named(ctx.guild, discord_name)
+            if discord_user:
+                new_str = f"{discord_user.mention}"
+            else:
+                log.error(f"Mapped user not found on discord: [{slack_name}: {discord_name}]\n"
+                          "        @mentions of user will not be translated to discord-equivalent")
+        else:
+            log.warning(f"User not mapped: {slack_name}")
+            log.info("Attempt to match the slack name instead")
+            discord_user = get_member_named(ctx.guild, slack_name)
+            if discord_user:
+                new_str = f"{discord_user.mention}"
+            else:
+                log.error(f"User not found on discord: {slack_name}\n"
+                          "        @mentions of user will contain their ID instead of display name")
+        return new_str
+
+    def resolve_channel(match):
+        name = channels.get(match.group("cid")) if channels else None
+        if not name:
+            return match.group(0)
+        new_str = f"#{name}"
+        channel = get_channel_named(ctx.guild, name)
+        if channel:
+            new_str = f"<#{channel.id}>"
+        else:
+            log.error(f"Channel not found on discord: {name}\n"
+                      "        #channel references of channel will not be translated to discord-equivalent")
+        return new_str
 
+    linked = False
 
-    if users:
-        for uid, slack_name in users.items():
-            old_str = f"<@{uid}>"
-            if old_str in message and slack_name:
-                new_str = f"@{slack_name}"
-                if slack2discord_uids and uid in slack2discord_uids:
-                    discord_name = slack2discord_uids[uid]
-                    discord_user = ctx.guild.get_member_named(discord_name)
-                    if discord_user:
-                        new_str = f"{discord_user.mention}"
-                    else:
-                        print(f"[ERROR] Mapped user not found on discord: [{slack_name}: {discord_name}]")
-                        print(f"        @mentions of user will not be translated to discord-equivalent")
-                else:
-                    print(f"[WARNING] User not mapped: {slack_name}")
-                    print(f"[FIX] Attempt to match the slack name instead")
-                    discord_user = ctx.guild.get_member_named(slack_name)
-                    if discord_user:
-                        new_str = f"{discord_user.mention}"
-                    else:
-                        print(f"[ERROR] User not found on discord: {slack_name}")
-                        print(f"        @mentions of user will contain their ID instead of display name")
+    def resolve_link(match):
+        nonlocal linked
+        linked = True
+        url = match.group("url")
+        return f"[{match.group('label') or url}]({url})"
 
-                message = message.replace(old_str, new_str)
-    if channels:
-        for cid, name in channels.items():
-            old_str = f"<#{cid}|{name}>"
-            if old_str in message:
-                new_str = f"#{name}"
-                channel = discord.utils.get(ctx.guild.channels, name=name)
-                if channel:
-                    new_str = f"<#{channel.id}>"
-                else:
-                    print(f"[ERROR] Channel not found on discord: {name}")
-                    print(f"        #channel references of channel will not be translated to discord-equivalent")
+    guild_id = ctx.guild.id
 
-                message = message.replace(old_str, new_str)
+    # Each distinct mention is resolved (and reported) once per import, however often it repeats.
+    #  Links are mostly unique and cheap to convert, so they aren't cached.
+    def resolve_token(match):
+        if match.group("url"):
+            return resolve_link(match)
+        key = (guild_id, match.group(0))
+        replacement = mention_cache.get(key)
+        if replacement is None:
+            replacement = resolve_user(match) if match.group("uid") else resolve_channel(match)
+            mention_cache[key] = replacement
+        return replacement
 
-    return message
+    filled = SLACK_TOKEN_RE.sub(resolve_token, message)
+    return filled, linked
 
 
 def parse_important_files(slack_dir):
     users = get_display_names(slack_dir)
     if users:
-        print(f"[INFO] users.json found - attempting to fill @mentions")
+        log.info("users.json found - attempting to fill @mentions")
     else:
-        print(f"[WARNING] No users.json found - @mentions will contain user IDs instead of display names")
+        log.warning("No users.json found - @mentions will contain user IDs instead of display names")
 
     slack2discord_uids = get_slack2discord_user_mapping(slack_dir, users)
     if slack2discord_uids:
-        print(f"[INFO] slack2discord_users.json found - attempting to map @mentions")
+        log.info("slack2discord_users.json found - attempting to map @mentions")
     else:
-        print(f"[ERROR] No slack2discord_users.json found.")
-        print(f"[FIX] Querying user for known mappings to generate file") # TODO
-        print(f"[ERROR] Querying feature not implemented - @mentions will not map")
+        log.error("No slack2discord_users.json found.")
+        log.info("Querying user for known mappings to generate file") # TODO
+        log.error("Querying feature not implemented - @mentions will not map")
 
     channels = get_channel_names(slack_dir)
     if channels:
-        print(f"[INFO] channels.json found - attempting to fill #channel references")
+        log.info("channels.json found - attempting to fill #channel references")
     else:
-        print(f"[WARNING] No channels.json found - #channel references will contain their IDs instead of names")
+        log.warning("No channels.json found - #channel references will contain their IDs instead of names")
 
     return users, slack2discord_uids, channels
 
@@ -655,34 +1030,88 @@ def parse_important_files(slack_dir):
 async def get_or_create_channel(ctx, name):
     channel = discord.utils.get(ctx.guild.channels, name=name, type=discord.ChannelType.text)
     if not channel:
-        print(f"[INFO] Could not find channel: {name}")
-        print(f"       Creating channel")
+        log.info(f"Could not find channel: {name}\n"
+                 "       Creating channel")
         channel = await ctx.guild.create_text_channel(name, reason="Migrating Slack channel")
+        clear_guild_caches(ctx.guild)
     return channel
 
 
+class WebhookDestination:
+    """
+    Sends a channel's messages through a webhook instead of as the bot (see USE_WEBHOOKS),
+    standing in for the channel (or one of its threads) wherever a ctx is sent to.
+    Webhooks can't reply, so this is only used with discord.py >= 2.0, where threads replace reply-chains.
+    """
+    def __init__(self, webhook, channel, thread=None, bucket=None):
+        self.webhook = webhook
+        self.channel = channel
+        self.guild = channel.guild
+        self.thread = thread
+        # Shared with for_thread's destinations, as they send through the same webhook
+        self.bucket = bucket or TokenBucket(1 / WEBHOOK_THROTTLE_TIME_SECONDS, THROTTLE_BURST)
+
+    def for_thread(self, thread):
+        return WebhookDestination(self.webhook, self.channel, thread, self.bucket)
+
+    async def send(self, content=None, reference=None, **kwargs):
+        # Webhook.send marks unset arguments as MISSING rather than None
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        if content is not None:
+            kwargs["content"] = content
+        if self.thread is not None:
+            kwargs["thread"] = self.thread
+        # wait=True returns the sent message, which threads are created from
+        return await self.webhook.send(wait=True, **kwargs)
+
+
+# async because of channel.webhooks and channel.create_webhook
+async def get_or_create_webhook(channel):
+    for webhook in await channel.webhooks():
+        if webhook.name == WEBHOOK_NAME:
+            return webhook
+    log.info(f"Creating webhook for channel: {channel.name}")
+    return await channel.create_webhook(name=WEBHOOK_NAME, reason="Migrating Slack channel")
+
+
 def parse_timestamp(message):
     if 'ts' in message:
-        return datetime.fromtimestamp(float(message['ts'])).strftime('%Y-%m-%d at %H:%M:%S')
+        seconds = int(float(message['ts']))
+        timestamp = timestamp_cache.get(seconds)
+        if not timestamp:
+            # Formatting the fields directly is several times faster than strftime's locale-aware path
+            t = time.localtime(seconds)
+            timestamp = '%04d-%02d-%02d at %02d:%02d:%02d' % (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
+            if len(timestamp_cache) >= TIMESTAMP_CACHE_SIZE:
+                timestamp_cache.clear()
+            timestamp_cache[seconds] = timestamp
+        return timestamp
     else:
-        print(f"[WARNING] No timestamp in message")
+        log.warning("No timestamp in message")
     return '<no timestamp>'
 
 
 def parse_user(ctx, message, users, slack2discord_uids):
     username = "<unknown user>"
-    if "user" in message:
-        print(f"[INFO] Located 'user' field, attempting to map uid to username")
-        uid = message['user']
-        try:
+    uid = message.get("user")
+    if uid is not None:
+        log.debug("Located 'user' field, attempting to map uid to username")
+        # Either dict is None when its file is missing; unmapped users fall back to their slack name, as in fill_references
+        slack_name = users.get(uid) if users else None
+        if slack2discord_uids and uid in slack2discord_uids:
             username = slack2discord_uids[uid]
-        except KeyError:
+            if not username:
+                # Mapped to "" to force the user to not be found, so shown by their slack name without a lookup
+                return f"@{slack_name or uid}"
+        else:
+            username = slack_name
+        if not username:
             username = f"<unknown user {uid}>"
-            print(f"[WARNING] Failed to map uid to slack username - name will remain the unmapped uid: {username}")
+            log.warning("Failed to map uid to slack username - name will remain the unmapped uid: %s", username)
     else:
-        print(f"[ERROR] No 'user' field in message - defaulting to '<unknown user>'")
+        log.error("No 'user' field in message - defaulting to '<unknown user>'")
 
-    discord_user = ctx.guild.get_member_named(username)
+    discord_user = get_member_named(ctx.guild, username)
     if discord_user:
         mention = f"{discord_user.mention}"
     else:
@@ -695,95 +1124,145 @@ def parse_text(ctx, message, username, users, slack2discord_uids, channels, mess
     text = message.get('text')
     if text:
         timestamp = parse_timestamp(message)
-        text = fill_references(ctx, text, users, slack2discord_uids, channels, messages)
-        return f"*{timestamp}* **{username}**: {text}"
+        text, linked = fill_references(ctx, text, users, slack2discord_uids, channels, messages)
+        return f"*{timestamp}* **{username}**: {text}", linked
     else:
-        return None
-
-import io
-import requests
-def parse_files(message):
-    # using mapping from https://developer.mozilla.org/en-US/docs/Web/HTTP/Basics_of_HTTP/MIME_types/Common_types
-    # because mimetypes.guess_extension returns silly results https://stackoverflow.com/questions/53541343/content-type-text-plain-has-file-extension-ksh
-    # within embeds, Discord only supports .gif .jpeg .jpg .json (Lottie) .png .webp images https://discord.com/developers/docs/reference#image-formatting-image-formats
-    extensions = {
-        "audio/aac": ".aac",
-        "application/x-abiword": ".abw",
-        "application/x-freearc": ".arc",
-        "image/avif": ".avif",
-        "video/x-msvideo": ".avi",
-        "application/vnd.amazon.ebook": ".azw",
-        "application/octet-stream": ".bin",
-        "image/bmp": ".bmp",
-        "application/x-bzip": ".bz",
-        "application/x-bzip2": ".bz2",
-        "application/x-cdf": ".cda",
-        "application/x-csh": ".csh",
-        "text/css": ".css",
-        "text/csv": ".csv",
-        "application/msword": ".doc",
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
-        "application/vnd.ms-fontobject": ".eot",
-        "application/epub+zip": ".epub",
-        "application/gzip": ".gz",
-        "image/gif": ".gif",
-        "text/html": ".html",
-        "image/vnd.microsoft.icon": ".ico",
-        "text/calendar": ".ics",
-        "application/java-archive": ".jar",
-        "image/jpeg": ".jpg",
-        "text/javascript": ".js",
-        "application/json": ".json",
-        "application/ld+json": ".jsonld",
-        "audio/midi audio/x-midi": ".midi",
-        "text/javascript": ".mjs",
-        "audio/mpeg": ".mp3",
-        "video/mp4": ".mp4",
-        "video/mpeg": ".mpeg",
-        "application/vnd.apple.installer+xml": ".mpkg",
-        "application/vnd.oasis.opendocument.presentation": ".odp",
-        "application/vnd.oasis.opendocument.spreadsheet": ".ods",
-        "application/vnd.oasis.opendocument.text": ".odt",
-        "audio/ogg": ".oga",
-        "video/ogg": ".ogv",
-        "application/ogg": ".ogx",
-        "audio/opus": ".opus",
-        "font/otf": ".otf",
-        "image/png": ".png",
-        "application/pdf": ".pdf",
-        "application/x-httpd-php": ".php",
-        "application/vnd.ms-powerpoint": ".ppt",
-        "application/vnd.openxmlformats-officedocument.presentationml.presentation": ".pptx",
-        "application/vnd.rar": ".rar",
-        "application/rtf": ".rtf",
-        "application/x-sh": ".sh",
-        "image/svg+xml": ".svg",
-        "application/x-tar": ".tar",
-        "image/tiff": ".tiff",
-        "video/mp2t": ".ts",
-        "font/ttf": ".ttf",
-        "text/plain": ".txt",
-        "application/vnd.visio": ".vsd",
-        "audio/wav": ".wav",
-        "audio/webm": ".weba",
-        "video/webm": ".webm",
-        "image/webp": ".webp",
-        "font/woff": ".woff",
-        "font/woff2": ".woff2",
-        "application/xhtml+xml": ".xhtml",
-        "application/vnd.ms-excel": ".xls",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
-        "application/xml": ".xml",
-        "text/xml": ".xml",
-        "application/atom+xml": ".xml",
-        "application/vnd.mozilla.xul+xml": ".xul",
-        "application/zip": ".zip",
-        "video/3gpp": ".3gp",
-        "audio/3gpp": ".3gp",
-        "video/3gpp2": ".3gp",
-        "audio/3gpp2": ".3g2",
-        "application/x-7z-compressed": ".7z"
-    }
+        return None, False
+
+
+# using mapping from https://developer.mozilla.org/en-US/docs/Web/HTTP/Basics_of_HTTP/MIME_types/Common_types
+# because mimetypes.guess_extension returns silly results https://stackoverflow.com/questions/53541343/content-type-text-plain-has-file-extension-ksh
+# within embeds, Discord only supports .gif .jpeg .jpg .json (Lottie) .png .webp images https://discord.com/developers/docs/reference#image-formatting-image-formats
+# Read-only view, as the table is shared by every parse_files call
+MIME_EXTENSIONS = types.MappingProxyType({
+    "audio/aac": ".aac",
+    "application/x-abiword": ".abw",
+    "application/x-freearc": ".arc",
+    "image/avif": ".avif",
+    "video/x-msvideo": ".avi",
+    "application/vnd.amazon.ebook": ".azw",
+    "application/octet-stream": ".bin",
+    "image/bmp": ".bmp",
+    "application/x-bzip": ".bz",
+    "application/x-bzip2": ".bz2",
+    "application/x-cdf": ".cda",
+    "application/x-csh": ".csh",
+    "text/css": ".css",
+    "text/csv": ".csv",
+    "application/msword": ".doc",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "application/vnd.ms-fontobject": ".eot",
+    "application/epub+zip": ".epub",
+    "application/gzip": ".gz",
+    "image/gif": ".gif",
+    "text/html": ".html",
+    "image/vnd.microsoft.icon": ".ico",
+    "text/calendar": ".ics",
+    "application/java-archive": ".jar",
+    "image/jpeg": ".jpg",
+    "text/javascript": ".js",
+    "application/json": ".json",
+    "application/ld+json": ".jsonld",
+    "audio/midi": ".midi",
+    "audio/x-midi": ".midi",
+    "audio/mpeg": ".mp3",
+    "video/mp4": ".mp4",
+    "video/mpeg": ".mpeg",
+    "application/vnd.apple.installer+xml": ".mpkg",
+    "application/vnd.oasis.opendocument.presentation": ".odp",
+    "application/vnd.oasis.opendocument.spreadsheet": ".ods",
+    "application/vnd.oasis.opendocument.text": ".odt",
+    "audio/ogg": ".oga",
+    "video/ogg": ".ogv",
+    "application/ogg": ".ogx",
+    "audio/opus": ".opus",
+    "font/otf": ".otf",
+    "image/png": ".png",
+    "application/pdf": ".pdf",
+    "application/x-httpd-php": ".php",
+    "application/vnd.ms-powerpoint": ".ppt",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": ".pptx",
+    "application/vnd.rar": ".rar",
+    "application/rtf": ".rtf",
+    "application/x-sh": ".sh",
+    "image/svg+xml": ".svg",
+    "application/x-tar": ".tar",
+    "image/tiff": ".tiff",
+    "video/mp2t": ".ts",
+    "font/ttf": ".ttf",
+    "text/plain": ".txt",
+    "application/vnd.visio": ".vsd",
+    "audio/wav": ".wav",
+    "audio/webm": ".weba",
+    "video/webm": ".webm",
+    "image/webp": ".webp",
+    "font/woff": ".woff",
+    "font/woff2": ".woff2",
+    "application/xhtml+xml": ".xhtml",
+    "application/vnd.ms-excel": ".xls",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
+    "application/xml": ".xml",
+    "text/xml": ".xml",
+    "application/atom+xml": ".xml",
+    "application/vnd.mozilla.xul+xml": ".xul",
+    "application/zip": ".zip",
+    "video/3gpp": ".3gp",
+    "audio/3gpp": ".3gp",
+    "video/3gpp2": ".3g2",
+    "audio/3gpp2": ".3g2",
+    "application/x-7z-compressed": ".7z"
+})
+
+
+# Files uploaded together share their timestamp; datetimes are immutable, so can be shared between embeds
+@functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def file_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp)
+
+
+def temporary_file():
+    """
+    Opens an anonymous temporary file as a plain io.BufferedRandom, which discord.File accepts.
+    tempfile.TemporaryFile returns a wrapper that isn't an io.IOBase on Windows.
+    :return: File opened for reading and writing in binary mode, deleted once closed
+    """
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    # Windows can't delete an open file, but O_TEMPORARY deletes it when closed
+    flags = os.O_RDWR | getattr(os, "O_BINARY", 0) | getattr(os, "O_TEMPORARY", 0)
+    f = open(os.open(path, flags), "w+b")
+    if not hasattr(os, "O_TEMPORARY"):
+        os.unlink(path)
+    return f
+
+async def download_file(session, file):
+    """
+    Downloads a Slack file, streaming it chunk by chunk into the file handed to discord.File.
+    Small files stay in memory, larger ones are spilled to a temporary file on disk.
+    :param session: aiohttp.ClientSession to download with
+    :param file: Slack file dict containing "url_private"
+    :return: File object positioned at the start of the download
+    """
+    # Not a SpooledTemporaryFile: before Python 3.11 it isn't an io.IOBase, which discord.File requires
+    content = io.BytesIO()
+    try:
+        async with session.get(file["url_private"]) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                if isinstance(content, io.BytesIO) and content.tell() + len(chunk) > DOWNLOAD_SPOOL_BYTES:
+                    spilled = temporary_file()
+                    spilled.write(content.getbuffer())
+                    content.close()
+                    content = spilled
+                content.write(chunk)
+    except BaseException:
+        content.close()
+        raise
+    content.seek(0)
+    return content
+
+# async because attachments are downloaded with aiohttp
+async def parse_files(message, session):
     # Slack files have params in the format:
     #  {
     #    "id": "F01A2BCDEFG",
@@ -835,15 +1314,36 @@ def parse_files(message):
 
     files = []
     embeds = []
+    downloads = []
     for file in message["files"]:
         if "url_private" in file:
-            response = requests.get(file["url_private"])
-            content = io.BytesIO(response.content)
-            extension = file["filetype"]
+            downloads.append(file)
+        else:
+            log.error(f"File has no 'url_private' field - Unable to migrate file: {file}")
+
+    # Download all of the message's attachments at once, so they take as long as the slowest rather than the sum
+    contents = await asyncio.gather(*[download_file(session, file) for file in downloads], return_exceptions=True)
+    for file, content in zip(downloads, contents):
+        if isinstance(content, Exception):
+            log.error("Unable to download file - Unable to migrate file: %s\n"
+                      "        %s: %s", file['title'], type(content).__name__, content)
+        else:
+            # Slack's filetype lacks the ".", and may not be the mimetype's usual extension (e.g. "jpg" for image/jpeg)
+            filetype_extension = "." + file["filetype"]
+            extension = MIME_EXTENSIONS.get(file["mimetype"], filetype_extension)
             filename = file["name"]
-            if not filename.endswith(extension):
-                filename = f'{filename}{extension}'
-            discord_file = discord.File(content, filename)
+            # Names from cameras are often upper case, e.g. "IMG_0001.JPG", and other extensions of the same type
+            #  are fine too, e.g. "photo.jpeg" or "scan.tif"
+            if (not filename.lower().endswith((extension, filetype_extension))
+                    and (not os.path.splitext(filename)[1] or mimetypes.guess_type(filename)[0] != file["mimetype"])):
+                filename += extension
+            try:
+                discord_file = discord.File(content, filename)
+            except (OSError, TypeError, ValueError) as e:
+                content.close()
+                log.error("Unable to attach file - Unable to migrate file: %s\n"
+                          "        %s: %s", file['title'], type(e).__name__, e)
+                continue
 
             if file["mimetype"].split('/')[0] == "image":
                 # https://discordpy.readthedocs.io/en/stable/api.html#embed
@@ -853,18 +1353,16 @@ def parse_files(message):
                     type="image", # rich, image, video, gifv, article, link https://discord.com/developers/docs/resources/channel#embed-object-embed-types
 #                    url=f'attachment://{filename}', # file["url_private"],
 #                   description=None,
-                    timestamp=datetime.fromtimestamp(file["timestamp"]),
+                    timestamp=file_datetime(file["timestamp"]),
                 )
                 discord_embed.set_image(url=f'attachment://{filename}') # e.url
                 embeds.append(discord_embed)
                 files.append(discord_file)
-                print(f"[INFO] Embedded file: {file['title']}")
+                log.debug("Embedded file: %s", file['title'])
             else:
                 files.append(discord_file)
-                print(f"[INFO] Attached file: {file['title']}")
+                log.debug("Attached file: %s", file['title'])
 
-        else:
-            print(f"[ERROR] File has no 'url_private' field - Unable to migrate file: {file}")
 #    files = [discord.Embed(**f) for f in files] 
 #    files = [e.set_image(url=e.url) for e in files]
 #    files_final = []
@@ -872,65 +1370,71 @@ def parse_files(message):
 #        files_final.append(discord.File(img, filename))
 
     if not "user" in message:
-        print(f"[DEBUG] files can't exist without a 'user' field!!!")
+        log.debug("files can't exist without a 'user' field!!!")
 
     return files, embeds
 
 
-def parse_message(ctx, message, users, slack2discord_uids, channels, messages):
+def split_text(text, limit):
+    """
+    Splits text into pieces of at most limit characters, breaking before the last newline that fits when there is one
+    :param text: String to split
+    :param limit: Maximum length of each piece
+    :return: List of the pieces, in order
+    """
+    pieces = []
+    start = 0
+    while len(text) - start > limit:
+        end = text.rfind('\n', start + 1, start + limit)
+        if end == -1:
+            end = start + limit
+        pieces.append(text[start:end])
+        start = end
+    pieces.append(text[start:])
+    return pieces
+
+
+# async because of parse_files
+async def parse_message(ctx, message, users, slack2discord_uids, channels, messages, session):
     msg = None
+    linked = False
     files = None
     embeds = None
+    get = message.get # Bound once, as every message is looked up several times
 
-    if message.get("subtype", None) == "channel_join":
-        print(f"[INFO] Message is a 'channel_join' message")
-        return None
-
-    if message.get("subtype", None) == "bot_message":
-        print(f"[INFO] Message is a 'bot_message' message")
+    subtype = get("subtype")
+    if subtype in SKIP_SUBTYPES:
+        log.debug("Message is a '%s' message", subtype)
         return None
     
-    msg_id = message.get("client_msg_id", None)
+    msg_id = get("client_msg_id")
     username = parse_user(ctx, message, users, slack2discord_uids)
     
-    if "text" in message:
-        msg = parse_text(ctx, message, username, users, slack2discord_uids, channels, messages)
+    text = get("text")
+    if text:
+        msg, linked = parse_text(ctx, message, username, users, slack2discord_uids, channels, messages)
     
-    if "files" in message:
-        files, embeds = parse_files(message)
+    if get("files"):
+        files, embeds = await parse_files(message, session)
 
     if msg:
-        msg = html.unescape(msg)
-        msg = msg.replace("<!everyone>", "@everyone")
-
-        #message = re.sub(r'<((?:http|ftp|https)://[\w_-]+(?:\.[\w_-]+)+[\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])\|(.*)>', process_link, message)
-        # slack_link = re.search(r'<((?:http|ftp|https)://[\w_-]+(?:\.[\w_-]+)+[\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])\|(.*)>', message)
-        # if slack_link:
-        #     link, text = slack_link.groups()
-        #     message = re.sub(r'<((?:http|ftp|https)://[\w_-]+(?:\.[\w_-]+)+[\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])\|(.*)>', "[\1](\2)", message)
-        msg_hyperlinked = re.sub(r'<(https?:[^|>]+)>', r"[\1](\1)", msg)
-        msg_hyperlinked = re.sub(r'<(https?:[^|>]+)\|([^>]+)>', r"[\2](\1)", msg_hyperlinked)
+        # Few messages contain entities or @everyone, and the substring checks are much cheaper than the regex
+        if "&" in msg or "<!" in msg:
+            msg = SLACK_ESCAPE_RE.sub(lambda match: SLACK_ESCAPES[match.group(0)], msg)
+
+        # Links were already converted to markdown by fill_references, which only renders inside embeds
         # FIXME: check MAX_TOTAL_EMBEDS_CHARACTERS and break up into separate messages if over 6000 char limit
-        if (msg != msg_hyperlinked) or (len(msg_hyperlinked) > MAX_CHARACTERS):
-            msg = msg_hyperlinked
-            while msg and (len(msg) > 0):
-                if len(msg) > MAX_EMBED_CHARACTERS:
-                    excerpt = msg[:MAX_EMBED_CHARACTERS]
-                    newline = excerpt.rfind('\n')
-                    excerpt = msg[:newline]
-                    next_msg = msg[newline:] # tail
-                else:
-                    excerpt = msg
-                    next_msg = None
+        if linked or (len(msg) > MAX_CHARACTERS):
+            embeds = embeds or []
+            for excerpt in split_text(msg, MAX_EMBED_CHARACTERS):
                 rich_embed = discord.Embed(
                     type="rich",
                     description=excerpt #,
     #                timestamp=datetime.fromtimestamp(file["timestamp"])
     # TODO: see also url, title, type=(article, link, video); set_image, set_footer, set_thumbnail, set_author; video, provider
                 )
-                embeds = embeds or []
                 embeds.append(rich_embed)
-                msg = next_msg
+            msg = None
 
     # Create message-header for pure attachments
     if files and not msg and not embeds:
@@ -939,176 +1443,271 @@ def parse_message(ctx, message, users, slack2discord_uids, channels, messages):
         msg = f"*{timestamp}* **{username}**: *Attachments:*"
     
     if not msg and not files and not embeds:
-        print(f"[ERROR] Failed to parse message: {message}")
+        log.error("Failed to parse message: %s", message)
         return None
 
-    thread = message.get("thread_ts", None)
+    thread = get("thread_ts")
 
     return msg_id, msg, files, embeds, thread
 
 # async because it uses ctx.send() which outputs a coroutine
 async def send_message(ctx, msg, ref=None, embeds=None, files=None, allowed_mentions=None):
-    if not msg and not files and not embeds:
-        print(f"[DEBUG] Why are you here? - Skipping empty message")
-        return None
+    # Empty lists of embeds/files are treated the same as None
+    if not embeds and not files:
+        # Plain text, the common case; parse_message already split long text with split_text,
+        #  so msg is within MAX_CHARACTERS
+        if not msg:
+            log.debug("Why are you here? - Skipping empty message")
+            return None
+        return await throttled_send(ctx, msg, reference=ref, allowed_mentions = allowed_mentions)
+
     # this is using TextChannel.send https://discordpy.readthedocs.io/en/stable/api.html#discord.TextChannel.send
     # FIXME: use:
     # nonce (int) – The nonce to use for sending this message. If the message was successfully sent, then the message will have a nonce with this value.
     # reference (Union[Message, MessageReference, PartialMessage]) – A reference to the Message to which you are replying, this can be created using to_reference() or passed directly as a Message. You can control whether this mentions the author of the referenced message using the replied_user attribute of allowed_mentions or by setting mention_author.
     # ? view (discord.ui.View) – A Discord UI View to add to the message.
-    
-    first_ref = None
-    last_ref = None
-    # Split and send message *until* the remainder is within the limit, with references
-    # FIXME: move this to parse_message and have it return multiple items
-#    bot_prefix = "*continuation:*\n"
-
-#    if msg:
-#        while len(msg) > MAX_CHARACTERS:
-#            excerpt = msg[:MAX_CHARACTERS]
-#            newline = excerpt.rfind('\n')
-#            excerpt = msg[:newline]
-#            ref = await ctx.send(excerpt, reference=ref, allowed_mentions = allowed_mentions)
-#            first_ref = first_ref or ref
-#            msg = bot_prefix+msg[newline:] # tail
-#            if THROTTLE:
-#                time.sleep(THROTTLE_TIME_SECONDS)
-
-    # Send the remainder, with any embeds attached
-    if not embeds and not files:
-        ref = await ctx.send(msg, reference=ref, allowed_mentions = allowed_mentions)
-        first_ref = first_ref or ref
-        if THROTTLE:
-            time.sleep(THROTTLE_TIME_SECONDS)
+
+    # FIXME: actually do the embed/file splitting
+    if embeds and (len(embeds) > MAX_EMBEDS):
+        log.info("Message contains over %d embeds.\n"
+                 "       They will be split into multiple messages,\n"
+                 "        referencing their parent.", MAX_EMBEDS)
+    if files and embeds and len(embeds) == 1 and len(files) == 1:
+        first_ref = await throttled_send(ctx, msg, file=files[0], embed=embeds[0], allowed_mentions = allowed_mentions)
     else:
-        # FIXME: actually do the embed/file splitting
-        if embeds and (len(embeds) > MAX_EMBEDS):
-            print(f"[INFO] Message contains over {MAX_EMBEDS} embeds.")
-            print(f"       They will be split into multiple messages,")
-            print(f"        referencing their parent.")
-        if files and embeds and len(embeds) == 1 and len(files) == 1:
-            first_ref = await ctx.send(msg, file=files[0], embed=embeds[0], allowed_mentions = allowed_mentions)
-        else:
-            first_ref = await ctx.send(msg, files=files, embeds=embeds, allowed_mentions = allowed_mentions)
-
-        # if discord.__version__[0] >= "2":
-        #     while embeds:
-        #         ref = await ctx.send(msg, embeds=embeds[:MAX_EMBEDS], reference=last_ref or ref, allowed_mentions = allowed_mentions)
-        #         first_ref = first_ref or ref
-        #         last_ref = last_ref or ref
-        #         if THROTTLE:
-        #             time.sleep(THROTTLE_TIME_SECONDS)
-        #         msg = "*Additional attachments:*"
-        #         embeds=embeds[MAX_EMBEDS:] # tail
-        # else:
-        #     for embed in embeds:
-        #         ref = await ctx.send(msg, embed=embed, reference=last_ref or ref, allowed_mentions = allowed_mentions)
-        #         first_ref = first_ref or ref
-        #         last_ref = last_ref or ref
-        #         if THROTTLE:
-        #             time.sleep(THROTTLE_TIME_SECONDS)
-        #         msg = "*Additional attachments:*"
+        first_ref = await throttled_send(ctx, msg, files=files or None, embeds=embeds or None, allowed_mentions = allowed_mentions)
+
+    # if DISCORD_V2:
+    #     while embeds:
+    #         ref = await ctx.send(msg, embeds=embeds[:MAX_EMBEDS], reference=last_ref or ref, allowed_mentions = allowed_mentions)
+    #         first_ref = first_ref or ref
+    #         last_ref = last_ref or ref
+    #         if THROTTLE:
+    #             time.sleep(THROTTLE_TIME_SECONDS)
+    #         msg = "*Additional attachments:*"
+    #         embeds=embeds[MAX_EMBEDS:] # tail
+    # else:
+    #     for embed in embeds:
+    #         ref = await ctx.send(msg, embed=embed, reference=last_ref or ref, allowed_mentions = allowed_mentions)
+    #         first_ref = first_ref or ref
+    #         last_ref = last_ref or ref
+    #         if THROTTLE:
+    #             time.sleep(THROTTLE_TIME_SECONDS)
+    #         msg = "*Additional attachments:*"
 
     return first_ref
 
+def load_json_log(path):
+    """
+    Loads one day's .json log. Runs in an executor thread, so errors are returned to the caller rather than printed.
+    :param path: Path to the .json log
+    :return: (messages, error) tuple, where messages is None if loading failed
+    """
+    try:
+        with open(path, "rb") as f:
+            return load_json(f), None
+    except (OSError, json.JSONDecodeError) as e:
+        return None, e
+
+async def iter_json_logs(paths):
+    """
+    Reads and decodes a channel's .json logs in the default executor's threads, one day ahead of the day being imported,
+    so only two days of a channel are in memory at a time
+    :param paths: Tuple of paths to the channel's .json logs, in date order
+    :return: Async iterator of (path, messages, error) tuples in the same order, where messages is None if loading failed
+    """
+    loop = asyncio.get_running_loop()
+    ahead = None
+    try:
+        for i, path in enumerate(paths):
+            current = ahead or loop.run_in_executor(None, load_json_log, path)
+            ahead = loop.run_in_executor(None, load_json_log, paths[i + 1]) if i + 1 < len(paths) else None
+            json_messages, error = await current
+            yield path, json_messages, error
+    finally:
+        if ahead is not None:
+            ahead.cancel()
+
 # async because it uses send_message which uses ctx.send() which outputs a coroutine
-async def import_files(ctx, fs, users, slack2discord_uids, channels, messages={}):
+async def import_files(ctx, logs, users, slack2discord_uids, channels, session, messages=None):
     # dict mapping slack msg-id -> discord message for migrating replies.
-    # messages = {}
+    #  A default of {} would be shared by every import the bot ever runs, holding on to all their messages
+    if messages is None:
+        messages = {}
     # dict mapping slack thread_timestamp -> discord thread
     #  If discord.py < 2.0 this is instead used to reference thread-owner
     # TODO: extract from or store with messages if present
     threads = {}
-    for json_file in sorted(fs):
-        print(f"[INFO] Parsing file: {json_file}")
+    # Threads sent to since they were last archived. Sending to an archived thread unarchives it,
+    #  so they are archived again after each file rather than after every message.
+    unarchived = {}
+    # Consecutive plain messages by the same user, waiting to be sent together (see COALESCE_MESSAGES)
+    pending = []
+    pending_user = None
+
+    async def send_pending():
+        if pending:
+            sent = await send_message(ctx, "\n".join(msg for _, msg in pending), allowed_mentions = DISABLE_MENTIONS)
+            for msg_id, _ in pending:
+                messages[msg_id] = sent
+            pending.clear()
+
+    async for json_file, json_messages, error in logs:
+        log.info(f"Parsing file: {json_file}")
         try:
-            with open(json_file, encoding="utf-8") as f:
-                for message in json.load(f):
-                    print(f"[INFO] Parsing message:")
-                    parsed = parse_message(ctx, message, users, slack2discord_uids, channels, messages)
-                    if parsed:
-                        msg_id, msg, files, embeds, thread_ts = parsed
-
-                        if msg or embeds or files:
-                            context = ctx
-                            thread_owner = None
-                            if not msg_id:
-                                print(f"[WARNING] No message-id found - will be unlinkable")
-                            # FIXME: Unicode
-                            print(f"[INFO] Importing message: '{msg}'")
-                            if thread_ts:
-                                # Prefix to clarify message owns/belongs to thread
-                                prefix = "[Thread OP] "
-                                if thread_ts in threads:
-                                    print(f"[INFO] Message belongs to thread: {thread_ts}")
-                                    if discord.__version__[0] < "2":
-                                        # Emulating threads by converting it into a reply-chain
-                                        thread_owner = threads[thread_ts]
-                                        prefix = "[Thread] "
-                                    else:
-                                        context = threads[thread_ts]
-                                if discord.__version__[0] < "2":
-                                    msg = prefix + msg
-
-
-                            disable_notifications = discord.AllowedMentions.none()
-                            message = await send_message(context, msg, ref=thread_owner, embeds=embeds if embeds else None, files=files if files else None, allowed_mentions = disable_notifications)
-                            messages[msg_id] = message
-
-                            if thread_ts:
-                                if not thread_ts in threads:
-                                    print(f"[INFO] Message owns a thread: {thread_ts}")
-                                    if discord.__version__[0] < "2":
-                                        print(f"       Contents will be sent directly to text-channel, referencing this, instead")
-                                        threads[thread_ts] = message
-                                    else:
-                                        print(f"       Creating thread")
-                                        threads[thread_ts] = await message.create_thread(name=thread_ts, reason="Migrating Slack thread")
-                                if discord.__version__[0] >= "2":
-                                    # Threads need to be archived after each message, as well as creation.
-                                    await threads[thread_ts].edit(archived=True)
-                            print(f"[INFO] Message imported!")
-
-                        if not msg:
-                            print(f"[ERROR] skipping message - Found neither text nor files in message: {message}")
+            if error:
+                raise error
+            for message in json_messages:
+                log.debug("Parsing message:")
+                parsed = await parse_message(ctx, message, users, slack2discord_uids, channels, messages, session)
+                if parsed:
+                    msg_id, msg, files, embeds, thread_ts = parsed
+
+                    if COALESCE_MESSAGES and msg and not files and not embeds and not thread_ts:
+                        user = message.get("user")
+                        if pending and (user != pending_user or sum(len(m) + 1 for _, m in pending) + len(msg) > MAX_CHARACTERS):
+                            await send_pending()
+                        pending.append((msg_id, msg))
+                        pending_user = user
+                        continue
+                    await send_pending()
+
+                    if msg or embeds or files:
+                        context = ctx
+                        thread_owner = None
+                        if not msg_id:
+                            log.debug("No message-id found - will be unlinkable")
+                        # FIXME: Unicode
+                        log.debug("Importing message: '%s'", msg)
+                        thread = threads.get(thread_ts) if thread_ts else None
+                        if thread_ts:
+                            # Prefix to clarify message owns/belongs to thread
+                            prefix = "[Thread OP] "
+                            if thread is not None:
+                                log.debug("Message belongs to thread: %s", thread_ts)
+                                if not DISCORD_V2:
+                                    # Emulating threads by converting it into a reply-chain
+                                    thread_owner = thread
+                                    prefix = "[Thread] "
+                                elif isinstance(ctx, WebhookDestination):
+                                    context = ctx.for_thread(thread)
+                                else:
+                                    context = thread
+                            if not DISCORD_V2:
+                                msg = prefix + msg
+
+
+                        sent = await send_message(context, msg, ref=thread_owner, embeds=embeds, files=files, allowed_mentions = DISABLE_MENTIONS)
+                        messages[msg_id] = sent
+
+                        if thread_ts:
+                            if thread is None:
+                                if not DISCORD_V2:
+                                    log.debug("Message owns a thread: %s\n"
+                                              "        Contents will be sent directly to text-channel, referencing this, instead", thread_ts)
+                                    thread = sent
+                                else:
+                                    log.debug("Message owns a thread: %s\n"
+                                              "        Creating thread", thread_ts)
+                                    thread = await sent.create_thread(name=thread_ts, reason="Migrating Slack thread")
+                                threads[thread_ts] = thread
+                            if DISCORD_V2:
+                                unarchived[thread_ts] = thread
+                        log.debug("Message imported!")
                     else:
-                        print(f"[INFO] Ignored unparsed message.")
-                    print(f"") # empty line
+                        log.error("skipping message - Found neither text nor files in message: %s", message)
+                else:
+                    log.debug("Ignored unparsed message.")
+            await send_pending()
         except OSError as e:
-            print(f"[ERROR] {e}")
+            log.error(f"{e}")
         except json.JSONDecodeError as e:
-            print(f"[ERROR] Unable to load json-file, skipping.\n  JSONDecodeError: {e}")
-        print(f"") # extra empty line
+            log.error(f"Unable to load json-file, skipping.\n  JSONDecodeError: {e}")
+        for thread in unarchived.values():
+            await thread.edit(archived=True)
+        unarchived.clear()
     return messages
 
 # async ecause it uses import_files which uses send_messages which uses ctx.send which outputs a coroutine
-async def import_slack_directory(ctx, path, slack_dir, match_channel=True, messages={}):
+async def import_slack_directory(ctx, path, slack_dir, match_channel=True, messages=None):
+    if messages is None:
+        messages = {}
     if not ctx:
-        print(f"[ERROR] Import aborted - No context was given!")
+        log.error("Import aborted - No context was given!")
     if not slack_dir:
-        print(f"[ERROR] Import aborted - Failed to parse any slack-log directory at {path}")
+        log.error(f"Import aborted - Failed to parse any slack-log directory at {path}")
     elif not slack_dir["history"]:
-        print(f"[ERROR] Import aborted - No .json files found at {path}")
+        log.error(f"Import aborted - No .json files found at {path}")
     else:
         if match_channel == True:
-            print(f"[INFO] Creating missing channels to facilitate channel-references")
+            log.info("Creating missing channels to facilitate channel-references")
             for ch in slack_dir["history"]:
-                print(f"[INFO] Checking channel: {ch}")
+                log.info(f"Checking channel: {ch}")
                 await get_or_create_channel(ctx, ch)
 
-        print(f"[INFO] Importing channels")
+        log.info("Importing channels")
         users, slack2discord_uids, channels = parse_important_files(slack_dir)
-        for ch, fs in slack_dir["history"].items():
-            print(f"[INFO] Importing channel: {ch}")
-            if match_channel == True:
-                ctx = await get_or_create_channel(ctx, ch)
-            messages = await import_files(ctx, fs, users, slack2discord_uids, channels)
-            print(f"[INFO] Completed importing channel: {ch}")
-        print(f"[INFO] Import complete")
+        # Mentions resolved by an earlier import may be stale, e.g. if slack2discord_users.json was edited
+        clear_guild_caches(ctx.guild)
+        prime_guild_caches(ctx.guild)
+        resolve_user_mappings(ctx.guild, slack2discord_uids)
+        # One pooled HTTP session for all attachment downloads, reusing connections to Slack's file host
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=DOWNLOAD_CONNECTIONS),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=DOWNLOAD_TIMEOUT_SECONDS, sock_read=DOWNLOAD_TIMEOUT_SECONDS),
+        ) as session:
+            # Each channel is sent in order, but separate channels overlap their round trips to Discord
+            #  (still within the shared send_bucket, unless sent through per-channel webhooks). Without match_channel
+            #  everything goes to the one ctx, so channels are then imported one after the other.
+            semaphore = asyncio.Semaphore(CHANNEL_CONCURRENCY if match_channel == True else 1)
+
+            async def import_channel(ch, paths):
+                logs = iter_json_logs(paths)
+                try:
+                    log.info(f"Importing channel: {ch}")
+                    channel_ctx = ctx
+                    if match_channel == True:
+                        channel_ctx = await get_or_create_channel(ctx, ch)
+                    if USE_WEBHOOKS and DISCORD_V2:
+                        channel = channel_ctx if match_channel == True else ctx.channel
+                        channel_ctx = WebhookDestination(await get_or_create_webhook(channel), channel)
+                    await import_files(channel_ctx, logs, users, slack2discord_uids, channels, session, messages)
+                    log.info(f"Completed importing channel: {ch}")
+                finally:
+                    await logs.aclose()
+                    semaphore.release()
+
+            # Each channel's next day file is read and decoded in a thread while the previous day is being sent.
+            #  Not in worker processes: unpickling their results back would cost about as much as orjson decoding.
+            workers = []
+            try:
+                for ch, paths in slack_dir["history"].items():
+                    # Wait for a free slot before starting a channel
+                    await semaphore.acquire()
+                    workers.append(asyncio.ensure_future(import_channel(ch, paths)))
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+        log.info("Import complete")
+    return messages
 
 
 # Command callbacks must be coroutines (i.e. async)
 def register_commands():
+    @bot.event
+    async def on_ready():
+        for guild in bot.guilds:
+            prime_guild_caches(guild)
+
+    @bot.event
+    async def on_member_join(member):
+        clear_guild_caches(member.guild)
+
+    @bot.event
+    async def on_guild_channel_create(channel):
+        clear_guild_caches(channel.guild)
+
     @bot.command(pass_context=True)
     async def import_all(ctx, *kwpath):
         """
@@ -1123,10 +1722,10 @@ def register_commands():
         """
         paths = list(kwpath)
         path = paths[0]
-        print(f"[INFO] Attempting to import '{path}' to server '#{ctx.message.guild.name}'")
+        log.info(f"Attempting to import '{path}' to server '#{ctx.message.guild.name}'")
         # await
         slack_dir = parse_slack_directory(path, force_all=True)
-        messages = await import_slack_directory(ctx, path, slack_dir, messages={})
+        messages = await import_slack_directory(ctx, path, slack_dir)
 
     @bot.command(pass_context=True)
     async def import_path(ctx, *kwpath):
@@ -1142,19 +1741,27 @@ def register_commands():
         """
         paths = list(kwpath)
         
-        print(f"[INFO] Attempting to import '{paths}' to server '#{ctx.message.guild.name}'")
+        log.info(f"Attempting to import '{paths}' to server '#{ctx.message.guild.name}'")
         # await
         slack_dir = parse_slack_directory(paths[0])
         if not slack_dir:
-            print(f"[ERROR] Failed to parse slack directory")
+            log.error("Failed to parse slack directory")
             return
 
+        history = collections.defaultdict(list)
+        for k, v in slack_dir["history"].items():
+            history[k].extend(v)
         for path in paths[1:]:
             # await
             slack_dir_2 = parse_slack_directory(path)
+            if not slack_dir_2:
+                log.error(f"Failed to parse slack directory - skipping path: {path}")
+                continue
             for k, v in slack_dir_2["history"].items():
-                slack_dir["history"][k] = slack_dir["history"].get(k,[]) + v
-        messages = await import_slack_directory(ctx, slack_dir["root"], slack_dir, messages={})
+                history[k].extend(v)
+        # A channel's logs may now come from several directories; they are named by date, so sort by file name
+        slack_dir["history"] = {k: tuple(sorted(v, key=os.path.basename)) for k, v in history.items()}
+        messages = await import_slack_directory(ctx, slack_dir["root"], slack_dir)
 
     @bot.command(pass_context=True)
     async def import_here(ctx, *kwpath):
@@ -1168,39 +1775,48 @@ def register_commands():
         """
         paths = list(kwpath)
         for path in paths:
-            print(f"[INFO] Attempting to import '{path}' to channel '#{ctx.message.channel.name}'")
+            log.info(f"Attempting to import '{path}' to channel '#{ctx.message.channel.name}'")
             # await
             slack_dir = parse_slack_directory(path)
-            messages = await import_slack_directory(ctx, path, slack_dir, match_channel=False, messages={})
+            messages = await import_slack_directory(ctx, path, slack_dir, match_channel=False)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Slack message history importer for Discord")
+    parser.add_argument("-v", "--verbose", action="store_true", help="also log every user, channel and user mapping loaded from the export, and every message imported")
+    parser.add_argument("--log-file", metavar="PATH", help="also append the log to this file")
+    args = parser.parse_args()
+    setup_logging(args.verbose, args.log_file)
+
     check_optional_dependencies()
     token = ""
-    for path in [f'{os.path.expanduser("~")}/.secrets/discord_token.txt', 'discord_token.txt']:
+    secrets = os.path.expanduser("~/.secrets/discord_token.txt")
+    for path in [secrets, 'discord_token.txt']:
         if token == "":
             if os.path.isfile( path ):
                 with open(path, "r") as f:
-                    for line in f:
-                        token = line.strip()
+                    token = f.readline().strip()
                 if token == "":
-                    print(f"Found {path} but it's empty")
+                    log.warning(f"Found {path} but it's empty")
                 else:
-                    print(f"Loaded token from {path}")
+                    log.info(f"Loaded token from {path}")
             else:
-                print(f"Couldn't find {path}")
+                log.info(f"Couldn't find {path}")
 
-    # FIXME: needs exception handling and expansion of "~"
     if token == "":
-        input("Enter bot token: ")
-        f = open("~/.secrets/discord_token.txt", "a")
-        f.write(token)
-        f.close()
-        print("Saved token to ~/.secrets/discord_token.txt")
+        token = query_user("Enter bot token: ").strip()
+        try:
+            os.makedirs(os.path.dirname(secrets), exist_ok=True)
+            # Overwritten, as only its first line is read and it gave no token
+            with open(secrets, "w") as f:
+                f.write(token)
+            log.info(f"Saved token to {secrets}")
+        except OSError as e:
+            log.warning(f"Couldn't save token to {secrets}: {e}")
 
     intents = discord.Intents.default()
     intents.members = True
-    if discord.__version__[0] >= "2":
+    if DISCORD_V2:
         intents.message_content = True
     bot = commands.Bot(command_prefix="!", intents=intents)
     register_commands()